@@ -2,26 +2,31 @@
 # -*- coding: utf-8 -*-
 """
 Generate unified RSS (XML), Atom, and HTML feeds for all Mend release notes (Docs + GitHub Renovate).
-Requires: requests, beautifulsoup4, feedgen, python-dateutil, bleach
+Requires: urllib3, brotli, lxml, selectolax, feedgen, python-dateutil, bleach
 """
 
 # stdlib
+import dbm
 import html
 import logging
+import os
+import pickle
 import re
+import shelve
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from urllib.parse import urljoin, urlparse
 
 # third-party
 import bleach
-import requests
-from bs4 import BeautifulSoup, Tag
+import urllib3
 from dateutil import parser as dateparser
 from feedgen.feed import FeedGenerator
+from lxml import etree
+from selectolax.lexbor import LexborHTMLParser
 
-logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
 
 # ─── URL Allowlist ─────────────────────────────────────────────────────────────
@@ -69,18 +74,91 @@ github_feeds: dict[str, str] = {
     "Mend Renovate CC-EE": "https://github.com/mend/renovate-ce-ee/releases.atom",
 }
 
+# Indented RSS/Atom output is only useful for debugging; set MEND_PRETTY=1 to get it
+PRETTY_XML = os.environ.get('MEND_PRETTY') == '1'
+
+# ─── Shared HTTP pool ──────────────────────────────────────────────────────────
+# Every docs page lives on docs.mend.io, so one keep-alive pool avoids a fresh
+# TCP+TLS handshake per request. urllib3 is used directly: a plain GET needs
+# none of the extra request/response machinery requests layers on top of it.
+# Without an explicit Accept-Encoding, http.client sends "identity" and the server
+# returns an uncompressed body; ask for gzip/brotli and let urllib3 inflate them
+# in C (brotli needs the optional brotli package).
+HTTP_HEADERS = {
+    'User-Agent': 'mend-release-feed (+https://bflam1.github.io/RSS/)',
+    'Accept-Encoding': 'gzip, br',
+}
+# Separate budgets so redirects (requests allowed 30) don't eat into the three
+# retries for connection and read failures.
+HTTP_RETRIES = urllib3.Retry(total=None, connect=3, read=3, other=3, redirect=10, backoff_factor=0.3)
+HTTP = urllib3.PoolManager(num_pools=4, maxsize=16, retries=HTTP_RETRIES)
+
+# ─── Conditional-GET cache ─────────────────────────────────────────────────────
+# Parsed entries are kept alongside each URL's ETag/Last-Modified so unchanged
+# pages come back as 304 Not Modified and skip both the body and the parse.
+# In CI the files are persisted by actions/cache, keyed on this script and
+# requirements.txt so a parsing change never reuses entries built by older code.
+CACHE_FILE = 'mend_release_cache'
+_http_cache: dict[str, dict] = {}
+
+def load_cache() -> None:
+    try:
+        with shelve.open(CACHE_FILE, flag='r') as db:
+            _http_cache.update(db)
+    except dbm.error:
+        logger.info("No usable cache at %s — fetching everything", CACHE_FILE)
+        _http_cache.clear()
+    except Exception as e:
+        # Truncated files, renamed pickled classes after a dependency bump, ...:
+        # a bad cache must never stop the feeds from being generated.
+        logger.warning("Discarding unreadable cache at %s: %s", CACHE_FILE, e)
+        _http_cache.clear()
+
+def save_cache() -> None:
+    try:
+        with shelve.open(CACHE_FILE, flag='n') as db:
+            db.update(_http_cache)
+    except (*dbm.error, pickle.PicklingError) as e:
+        logger.warning("Could not save cache to %s: %s", CACHE_FILE, e)
+
+def conditional_headers(url: str) -> dict[str, str]:
+    headers = dict(HTTP_HEADERS)
+    cached = _http_cache.get(url)
+    if not cached:
+        return headers
+    if cached['etag']:
+        headers['If-None-Match'] = cached['etag']
+    if cached['last_modified']:
+        headers['If-Modified-Since'] = cached['last_modified']
+    return headers
+
+def http_get(url: str) -> urllib3.BaseHTTPResponse:
+    resp = HTTP.request('GET', url, timeout=10, headers=conditional_headers(url))
+    if resp.status >= 400:
+        raise OSError(f"HTTP {resp.status} for {url}")
+    return resp
+
+def remember(url: str, resp: urllib3.BaseHTTPResponse, entry: dict) -> dict:
+    etag = resp.headers.get('ETag')
+    last_modified = resp.headers.get('Last-Modified')
+    if etag or last_modified:
+        _http_cache[url] = {'etag': etag, 'last_modified': last_modified, 'entry': entry}
+    return entry
+
 # ─── Utility: Normalize quotes ─────────────────────────────────────────────────
+_QUOTE_TABLE = str.maketrans({
+    '\u201c': '"', '\u201d': '"', '\u201e': '"', '\u201f': '"',
+    '\u2018': "'", '\u2019': "'",
+})
+
 def normalize_quotes(text: str) -> str:
-    text = html.unescape(text)
-    for ch in ['\u201c', '\u201d', '\u201e', '\u201f']:
-        text = text.replace(ch, '"')
-    for ch in ['\u2018', '\u2019']:
-        text = text.replace(ch, "'")
-    return text
+    return html.unescape(text).translate(_QUOTE_TABLE)
 
 # ─── Helper: parse date from version header ────────────────────────────────────
+_VERSION_DATE_RE = re.compile(r'\(([^)]+)\)')
+
 def parse_version_date(version_text: str) -> datetime:
-    m = re.search(r'\(([^)]+)\)', version_text)
+    m = _VERSION_DATE_RE.search(version_text)
     if m:
         try:
             dt = dateparser.parse(m.group(1))
@@ -92,55 +170,84 @@ def parse_version_date(version_text: str) -> datetime:
     return datetime.now(timezone.utc)
 
 # ─── Helper: fetch a Mend docs release page ────────────────────────────────────
+_HEADER_TAGS = frozenset({'h2', 'h3', 'h4'})
+# href attributes of <a> start tags only; a literal '<' in text serializes as
+# &lt;, so example markup inside <code> blocks can never match
+_HREF_RE = re.compile(r'(<a\b[^>]*?\shref=")([^"]*)"')
+
 def fetch_latest_release_html(name: str, url: str) -> dict:
     validate_url(url)
-    resp = requests.get(url, timeout=10, verify=True)
-    resp.raise_for_status()
-    soup = BeautifulSoup(resp.content, 'html.parser')
-
-    header = next(
-        (tag for tag in soup.find_all(['h2', 'h3', 'h4'])
-         if tag.get_text(strip=True).lower().startswith('version')),
-        None,
-    )
-    if not header:
-        header = soup.find(['h2', 'h3', 'h4'])
+    resp = http_get(url)
+    if resp.status == 304 and url in _http_cache:
+        logger.info("%s unchanged since last run", name)
+        return _http_cache[url]['entry']
+    tree = LexborHTMLParser(resp.data, encoding=True)
+
+    # Stop at the first "Version ..." header, keeping its text for the title
+    headers = tree.css('h2, h3, h4')
+    header, version_text = None, ''
+    for node in headers:
+        text = node.text(strip=True)
+        if text[:7].lower() == 'version':
+            header, version_text = node, text
+            break
+    if not header and headers:
+        header = headers[0]
+        version_text = header.text(strip=True)
     if not header:
         logger.warning("No version header found for %s", name)
         return {'title': f"{name}: Release", 'link': url, 'description': '', 'pubDate': datetime.now(timezone.utc)}
 
-    version_text = header.get_text(strip=True)
-
-    fragment = BeautifulSoup('', 'html.parser')
-    for sib in header.next_siblings:
-        if isinstance(sib, Tag) and sib.name in ['h2', 'h3', 'h4']:
-            break
-        fragment.append(sib)
+    parts: list[str] = []
+    sib = header.next
+    while sib is not None and sib.tag not in _HEADER_TAGS:
+        parts.append(sib.html)
+        sib = sib.next
 
-    for a in fragment.find_all('a', href=True):
-        href = a['href']
-        if not href.startswith(('http://', 'https://', '#', 'mailto:')):
-            a['href'] = urljoin(url, href)
+    details_html = _HREF_RE.sub(
+        lambda m: m.group(0) if m.group(2).startswith(('http://', 'https://', '#', 'mailto:'))
+        else f'{m.group(1)}{urljoin(url, m.group(2))}"',
+        ''.join(parts),
+    )
 
-    return {
+    return remember(url, resp, {
         'title': f"{name}: {version_text}",
         'link': url,
-        'description': normalize_quotes(str(fragment)),
+        'description': normalize_quotes(details_html),
         'pubDate': parse_version_date(version_text),
+    })
+
+# ─── Helper: parse the newest entry of a GitHub Atom feed ──────────────────────
+ATOM_NS = {'a': 'http://www.w3.org/2005/Atom'}
+# Remote XML: never resolve entities or reach out to the network for DTDs
+_ATOM_PARSER = etree.XMLParser(resolve_entities=False, no_network=True)
+
+def parse_github_atom(content: bytes, feed_url: str) -> dict | None:
+    root = etree.fromstring(content, _ATOM_PARSER)
+    entry = root.find('a:entry', ATOM_NS)
+    if entry is None:
+        return None
+    link = entry.find('a:link', ATOM_NS)
+    return {
+        'title': entry.findtext('a:title', default='', namespaces=ATOM_NS),
+        'summary': entry.findtext('a:summary', default='', namespaces=ATOM_NS),
+        'updated': entry.findtext('a:updated', default='', namespaces=ATOM_NS),
+        'link': link.get('href', feed_url) if link is not None else feed_url,
     }
 
 # ─── Helper: fetch a GitHub Atom feed entry ────────────────────────────────────
 def fetch_github_feed(name: str, feed_url: str) -> dict | None:
     validate_url(feed_url)
-    resp = requests.get(feed_url, timeout=10, verify=True)
-    resp.raise_for_status()
-    soup = BeautifulSoup(resp.content, 'xml')
-    entry_xml = soup.find('entry')
-    if not entry_xml:
+    resp = http_get(feed_url)
+    if resp.status == 304 and feed_url in _http_cache:
+        logger.info("%s unchanged since last run", name)
+        return _http_cache[feed_url]['entry']
+    atom = parse_github_atom(resp.data, feed_url)
+    if not atom:
         logger.warning("No entries found in GitHub feed for %s", name)
         return None
 
-    updated = entry_xml.updated.text if entry_xml.updated else ''
+    updated = atom['updated']
     try:
         timestamp = (
             datetime.fromisoformat(updated.replace('Z', '+00:00'))
@@ -151,48 +258,47 @@ def fetch_github_feed(name: str, feed_url: str) -> dict | None:
         logger.warning("Failed to parse timestamp %r for %s", updated, name)
         timestamp = datetime.now(timezone.utc)
 
-    summary_tag = entry_xml.find('summary')
-    summary_text = summary_tag.text if summary_tag and summary_tag.text else ''
-    raw_link = entry_xml.link['href'] if entry_xml.link and entry_xml.link.has_attr('href') else feed_url
+    raw_link = atom['link']
     try:
         link = validate_url(raw_link)
     except ValueError:
         logger.warning("Invalid link in GitHub feed for %s: %r — falling back to feed URL", name, raw_link)
         link = feed_url
 
-    return {
-        'title': f"{name}: {entry_xml.title.text}",
+    return remember(feed_url, resp, {
+        'title': f"{name}: {atom['title']}",
         'link': link,
-        'description': f"<p>{normalize_quotes(summary_text)}</p>",
+        'description': f"<p>{normalize_quotes(atom['summary'])}</p>",
         'pubDate': timestamp,
-    }
+    })
 
 # ─── Build feed entries in parallel ────────────────────────────────────────────
+def _fetch_or_none(fetch: Callable[[str, str], dict | None], name: str, url: str) -> dict | None:
+    try:
+        return fetch(name, url)
+    except Exception as e:
+        logger.error("Failed to fetch %s: %s", name, e)
+        return None
+
 def collect_entries() -> list[dict]:
-    futures: dict = {}
-    raw_results: dict[str, dict | None] = {}
-
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        for name, url in release_pages.items():
-            futures[executor.submit(fetch_latest_release_html, name, url)] = name
-        for name, url in github_feeds.items():
-            futures[executor.submit(fetch_github_feed, name, url)] = name
-
-        for future in as_completed(futures):
-            name = futures[future]
-            try:
-                raw_results[name] = future.result()
-            except Exception as e:
-                logger.error("Failed to fetch %s: %s", name, e)
-                raw_results[name] = None
-
-    # Rebuild in original insertion order; deduplicate by link
+    jobs = [(fetch_latest_release_html, name, url) for name, url in release_pages.items()]
+    jobs += [(fetch_github_feed, name, url) for name, url in github_feeds.items()]
+
+    # One worker per source so every request is in flight at once and total
+    # latency tracks the slowest page rather than the sum of round-trips.
+    # executor.map yields results in submission order, so no reordering is needed.
+    with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        results = list(executor.map(_fetch_or_none, *zip(*jobs)))
+
+    # Deduplicate by link; precompute the escaped title/link and ISO date once
     entries: list[dict] = []
     seen_links: set[str] = set()
-    for name in list(release_pages) + list(github_feeds):
-        entry = raw_results.get(name)
+    for entry in results:
         if entry and entry['link'] not in seen_links:
             seen_links.add(entry['link'])
+            entry['title_esc'] = html.escape(entry['title'], quote=True)
+            entry['link_esc'] = html.escape(entry['link'], quote=True)
+            entry['iso'] = entry['pubDate'].isoformat()
             entries.append(entry)
 
     return entries
@@ -229,44 +335,48 @@ def generate_feeds(entries: list[dict]) -> None:
         fe.content(e['description'], type='html')
         fe.pubDate(e['pubDate'])
 
-    rss_str = fg.rss_str(pretty=True)
-    if isinstance(rss_str, (bytes, bytearray)):
-        rss_str = rss_str.decode('utf-8')
-    with open('mend_combined_release_feed.xml', 'w', encoding='utf-8') as f:
-        f.write(rss_str)
+    fg.rss_file('mend_combined_release_feed.xml', pretty=PRETTY_XML)
     logger.info("RSS feed written: mend_combined_release_feed.xml")
 
-    atom_str = fg.atom_str(pretty=True)
-    if isinstance(atom_str, (bytes, bytearray)):
-        atom_str = atom_str.decode('utf-8')
-    with open('mend_combined_release_feed.atom', 'w', encoding='utf-8') as f:
-        f.write(atom_str)
+    fg.atom_file('mend_combined_release_feed.atom', pretty=PRETTY_XML)
     logger.info("Atom feed written: mend_combined_release_feed.atom")
 
-    with open('mend_combined_release_feed.html', 'w', encoding='utf-8') as f:
-        f.write('<!DOCTYPE html>\n<html lang="en">\n<head>\n')
-        f.write('  <meta charset="utf-8">\n')
-        f.write('  <title>Mend.io Unified Release Notes</title>\n</head>\n<body>\n')
-        f.write('  <h1>Mend.io Unified Release Notes</h1>\n')
-        for e in entries:
-            iso = e['pubDate'].isoformat()
-            safe_link = html.escape(e['link'], quote=True)
-            safe_title = html.escape(e['title'])
-            f.write(f'  <section>\n    <h2><a href="{safe_link}">{safe_title}</a></h2>\n')
-            f.write(f'    <time datetime="{iso}">{iso}</time>\n')
-            safe_desc = bleach.clean(e['description'], tags=BLEACH_TAGS, attributes=BLEACH_ATTRS, strip=True)
-            f.write(f'    {safe_desc}\n')
-            f.write('  </section>\n  <hr/>\n')
-        f.write('</body>\n</html>')
+    write_html(entries)
+
+# ─── Write the HTML page ───────────────────────────────────────────────────────
+def write_html(entries: list[dict]) -> None:
+    parts = [
+        '<!DOCTYPE html>\n<html lang="en">\n<head>\n',
+        '  <meta charset="utf-8">\n',
+        '  <title>Mend.io Unified Release Notes</title>\n</head>\n<body>\n',
+        '  <h1>Mend.io Unified Release Notes</h1>\n',
+    ]
+    for e in entries:
+        safe_desc = bleach.clean(e['description'], tags=BLEACH_TAGS, attributes=BLEACH_ATTRS, strip=True)
+        parts.append(
+            f'  <section>\n    <h2><a href="{e["link_esc"]}">{e["title_esc"]}</a></h2>\n'
+            f'    <time datetime="{e["iso"]}">{e["iso"]}</time>\n'
+            f'    {safe_desc}\n'
+            '  </section>\n  <hr/>\n'
+        )
+    parts.append('</body>\n</html>')
+    with open('mend_combined_release_feed.html', 'wb') as f:
+        f.write(''.join(parts).encode('utf-8'))
     logger.info("HTML feed written: mend_combined_release_feed.html")
 
 # ─── Entry point ───────────────────────────────────────────────────────────────
 def main() -> int:
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
     logger.info("Starting Mend release feed generation...")
-    entries = collect_entries()
+    load_cache()
+    try:
+        entries = collect_entries()
+    finally:
+        HTTP.clear()
     if not validate_output(entries):
         return 1
     generate_feeds(entries)
+    save_cache()
     logger.info("Done. %d feed entries written.", len(entries))
     return 0
 